@@ -10,18 +10,20 @@
 #
 
 import os
-import sys
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+from tqdm import tqdm
 from typing import Callable, NamedTuple
 
 import yaml
 from .colmap_loader import read_extrinsics_text, read_intrinsics_text, qvec2rotmat, \
     read_extrinsics_binary, read_intrinsics_binary, read_points3D_binary, read_points3D_text
-from ..utils.graphics_utils import getWorld2View2, focal2fov, fov2focal
+from ..utils.graphics_utils import focal2fov, fov2focal
 import numpy as np
 import json
 from pathlib import Path
-from plyfile import PlyData, PlyElement
+from plyfile import PlyData
 from ..utils.sh_utils import SH2RGB
 from .gaussian_model import BasicPointCloud
 
@@ -47,19 +49,17 @@ class SceneInfo(NamedTuple):
 
 def getNerfppNorm(cam_info):
     def get_center_and_diag(cam_centers):
-        cam_centers = np.hstack(cam_centers)
-        avg_cam_center = np.mean(cam_centers, axis=1, keepdims=True)
+        avg_cam_center = np.mean(cam_centers, axis=0)
         center = avg_cam_center
-        dist = np.linalg.norm(cam_centers - center, axis=0, keepdims=True)
+        dist = np.linalg.norm(cam_centers - center, axis=1)
         diagonal = np.max(dist)
-        return center.flatten(), diagonal
+        return center, diagonal
 
-    cam_centers = []
-
-    for cam in cam_info:
-        W2C = getWorld2View2(cam.R, cam.T)
-        C2W = np.linalg.inv(W2C)
-        cam_centers.append(C2W[:3, 3:4])
+    # W2C = [R^T | T] (see getWorld2View2), so the camera center is -R @ T
+    # the scene radius does not need double precision
+    R = np.stack([cam.R for cam in cam_info], dtype=np.float32)
+    T = np.stack([cam.T for cam in cam_info], dtype=np.float32)
+    cam_centers = np.einsum('nij,nj->ni', R, -T)
 
     center, diagonal = get_center_and_diag(cam_centers)
     radius = diagonal * 1.1
@@ -76,21 +76,41 @@ def readColmapCameras(
     depth_cam_folder=None,
     depth_est_folder=None,
 ):
-    cam_infos: list[CameraInfo] = []
-    for idx, key in enumerate(cam_extrinsics):
-        sys.stdout.write('\r')
-        # the exact output you're looking for:
-        sys.stdout.write("Reading camera {}/{}".format(idx+1, len(cam_extrinsics)))
-        sys.stdout.flush()
+    cam_infos: list[CameraInfo | None] = [None] * len(cam_extrinsics)
+    # list the folder once instead of probing every image path with stat()
+    image_files = {entry.name for entry in os.scandir(images_folder)}
+
+    # qvec2rotmat is elementwise, so feeding it all quaternions as (4, N) yields every rotation as (3, 3, N)
+    qvecs = np.array([cam_extrinsics[key].qvec for key in cam_extrinsics]).reshape(-1, 4)
+    R_all = np.transpose(qvec2rotmat(qvecs.T), (2, 1, 0)).astype(np.float32)
+    T_all = np.array([cam_extrinsics[key].tvec for key in cam_extrinsics], dtype=np.float32).reshape(-1, 3)
+
+    image_paths = []
+    for key in cam_extrinsics:
+        image_file = os.path.basename(cam_extrinsics[key].name)
+
+        if image_file not in image_files:
+            image_file = image_file.rsplit(".", 1)[0] + ".png"
+
+        image_path = os.path.join(images_folder, image_file)
+        if image_file not in image_files:
+            raise FileNotFoundError(f"Image file not found at {image_path}")
+        image_paths.append(image_path)
+
+    # the intrinsics hold the resolution COLMAP ran at, but the images folder may be downscaled,
+    # so read the actual sizes; the header reads are filesystem latency bound, so overlap them across threads
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+        image_sizes = list(executor.map(readImageSize, image_paths))
 
+    for idx, key in enumerate(tqdm(cam_extrinsics, desc="Reading camera")):
         extr = cam_extrinsics[key]
         intr = cam_intrinsics[extr.camera_id]
         height = intr.height
         width = intr.width
 
         uid = intr.id
-        R = np.transpose(qvec2rotmat(extr.qvec))
-        T = np.array(extr.tvec)
+        R = R_all[idx]
+        T = T_all[idx]
 
         if intr.model=="SIMPLE_PINHOLE":
             focal_length_x = intr.params[0]
@@ -104,14 +124,9 @@ def readColmapCameras(
         else:
             assert False, "Colmap camera model not handled: only undistorted datasets (PINHOLE or SIMPLE_PINHOLE cameras) supported!"
 
-        image_path = os.path.join(images_folder, os.path.basename(extr.name))
-        image_name = os.path.basename(image_path).split(".")[0]
-
-        if not os.path.exists(image_path):
-            image_path = image_path.rsplit(".", 1)[0] + ".png"
-
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image file not found at {image_path}")
+        image_path = image_paths[idx]
+        image_name = os.path.basename(extr.name).split(".")[0]
+        width, height = image_sizes[idx]
 
         depth_cam_path = None
         if depth_cam_folder is not None:
@@ -134,35 +149,54 @@ def readColmapCameras(
             width=width,
             height=height,
         )
-        cam_infos.append(cam_info)
-    sys.stdout.write('\n')
+        cam_infos[idx] = cam_info
     return cam_infos
 
 
 def fetchPly(path):
     plydata = PlyData.read(path)
     vertices = plydata['vertex']
-    positions = np.vstack([vertices['x'], vertices['y'], vertices['z']]).T
-    colors = np.vstack([vertices['red'], vertices['green'], vertices['blue']]).T / 255.0
+    positions = np.stack((vertices['x'], vertices['y'], vertices['z']), axis=-1).astype(np.float32, copy=False)
+    colors = np.stack((vertices['red'], vertices['green'], vertices['blue']), axis=-1).astype(np.float32) / np.float32(255.0)
     # normals = np.vstack([vertices['nx'], vertices['ny'], vertices['nz']]).T
     return BasicPointCloud(points=positions, colors=colors, normals=None)
 
-def storePly(path, xyz, rgb):
+def storePly(path, xyz, rgb, normals=None):
     # Define the dtype for the structured array
-    dtype = [('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
-            ('nx', 'f4'), ('ny', 'f4'), ('nz', 'f4'),
-            ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
-    
-    normals = np.zeros_like(xyz)
+    dtype = [('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+            ('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4'),
+            ('red', '<u1'), ('green', '<u1'), ('blue', '<u1')]
 
-    elements = np.empty(xyz.shape[0], dtype=dtype)
-    attributes = np.concatenate((xyz, normals, rgb), axis=1)
-    elements[:] = list(map(tuple, attributes))
+    if normals is None:
+        zeros = np.zeros(xyz.shape[0], dtype='<f4')
+        normal_columns = [zeros, zeros, zeros]
+    else:
+        normal_columns = [normals[:, 0], normals[:, 1], normals[:, 2]]
+
+    elements = np.rec.fromarrays(
+        [xyz[:, 0], xyz[:, 1], xyz[:, 2], *normal_columns, rgb[:, 0], rgb[:, 1], rgb[:, 2]],
+        dtype=dtype,
+    )
 
-    # Create the PlyData object and write to file
-    vertex_element = PlyElement.describe(elements, 'vertex')
-    ply_data = PlyData([vertex_element])
-    ply_data.write(path)
+    # Write the header and the vertex buffer directly, bypassing plyfile's per-element writer
+    ply_types = {'<f4': 'float', '<u1': 'uchar'}
+    header = "ply\nformat binary_little_endian 1.0\n"
+    header += f"element vertex {len(elements)}\n"
+    header += "".join(f"property {ply_types[t]} {name}\n" for name, t in dtype)
+    header += "end_header\n"
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        elements.tofile(f)
+
+def readImageSize(path):
+    # PNG stores its size at a fixed offset in the IHDR chunk, so avoid setting up a PIL decoder
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+            return struct.unpack('>II', header[16:24])
+        f.seek(0)
+        with Image.open(f) as image:
+            return image.size
 
 def readColmapSceneInfo(path, images, eval, split_yml_name=None):
     try:
@@ -184,7 +218,7 @@ def readColmapSceneInfo(path, images, eval, split_yml_name=None):
         depth_cam_folder=os.path.join(path, "depths_cam") if os.path.exists(os.path.join(path, "depths")) else None,
         depth_est_folder=os.path.join(path, "depths_est") if os.path.exists(os.path.join(path, "depths_est")) else None
     )
-    cam_infos = sorted(cam_infos_unsorted.copy(), key = lambda x : x.image_name)
+    cam_infos = sorted(cam_infos_unsorted, key = lambda x : x.image_name)
 
     if eval:
         split_file = os.path.join(path, split_yml_name)
@@ -193,10 +227,10 @@ def readColmapSceneInfo(path, images, eval, split_yml_name=None):
         print("Reading split file")
         with open(split_file, "r") as f:
             split = yaml.safe_load(f)
-        train_list = split["train"]
-        test_list = split["test"]
-        train_cam_infos = [c for c in cam_infos if c.image_name in train_list]
-        test_cam_infos = [c for c in cam_infos if c.image_name in test_list]
+        train_set = set(split["train"])
+        test_set = set(split["test"])
+        train_cam_infos = [c for c in cam_infos if c.image_name in train_set]
+        test_cam_infos = [c for c in cam_infos if c.image_name in test_set]
         # else:
         #     print("Split file not found, using LLFF holdout")
         #     raise NotImplementedError("LLFF holdout not implemented for this work")
@@ -248,7 +282,21 @@ def readCamerasFromTransforms(
         fovx = contents["camera_angle_x"]
 
         frames = contents["frames"]
-        for idx, frame in enumerate(frames):
+
+        # NeRF 'transform_matrix' is a camera-to-world transform
+        c2w = np.array([frame["transform_matrix"] for frame in frames]).reshape(-1, 4, 4)
+        # change from OpenGL/Blender camera axes (Y up, Z back) to COLMAP (Y down, Z forward)
+        if isOpenGL:
+            c2w[:, :3, 1:3] *= -1
+
+        # get the world-to-camera transform [R_c2w^T | -R_c2w^T t] and set R, T;
+        # R is stored transposed due to 'glm' in CUDA code, which is R_c2w itself
+        R_all = c2w[:, :3, :3]
+        T_all = -np.einsum('nji,nj->ni', R_all, c2w[:, :3, 3])
+        R_all = R_all.astype(np.float32)
+        T_all = T_all.astype(np.float32)
+
+        def probeFrame(frame):
             cam_name = os.path.join(images_dir, frame["file_path"].rsplit("/",1)[1])
             if os.path.exists(cam_name+extension):
                 cam_name += extension
@@ -258,22 +306,18 @@ def readCamerasFromTransforms(
             if not os.path.exists(cam_name):
                 raise FileNotFoundError(f"Image file not found at {cam_name}")
 
-            # NeRF 'transform_matrix' is a camera-to-world transform
-            c2w = np.array(frame["transform_matrix"])
-            # change from OpenGL/Blender camera axes (Y up, Z back) to COLMAP (Y down, Z forward)
-            if isOpenGL:
-                c2w[:3, 1:3] *= -1
+            image_path = os.path.join(path, cam_name)
+            return image_path, Path(cam_name).stem, *readImageSize(image_path)
 
-            # get the world-to-camera transform and set R, T
-            w2c = np.linalg.inv(c2w)
-            R = np.transpose(w2c[:3,:3])  # R is stored transposed due to 'glm' in CUDA code
-            T = w2c[:3, 3]
+        # the per-frame work is filesystem latency bound, so overlap it across threads
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            probes = list(executor.map(probeFrame, frames))
 
-            image_path = os.path.join(path, cam_name)
-            image_name = Path(cam_name).stem
-            image = Image.open(image_path)
+        for idx, (image_path, image_name, width, height) in enumerate(probes):
+            R = R_all[idx]
+            T = T_all[idx]
 
-            fovy = focal2fov(fov2focal(fovx, image.size[0]), image.size[1])
+            fovy = focal2fov(fov2focal(fovx, width), height)
             FovY = fovy 
             FovX = fovx
 
@@ -295,8 +339,8 @@ def readCamerasFromTransforms(
                 depth_est_path=depth_est_path,
                 image_path=image_path,
                 image_name=image_name,
-                width=image.size[0],
-                height=image.size[1],
+                width=width,
+                height=height,
             )
 
             cam_infos.append(cam_info)
@@ -322,11 +366,14 @@ def readNerfSyntheticInfo(path, white_background, eval, extension=".png"):
         print(f"Generating random point cloud ({num_pts})...")
 
         # We create random points inside the bounds of the synthetic Blender scenes
-        xyz = np.random.random((num_pts, 3)) * 2.6 - 1.3
-        shs = np.random.random((num_pts, 3)) / 255.0
-        pcd = BasicPointCloud(points=xyz, colors=SH2RGB(shs), normals=np.zeros((num_pts, 3)))
-
-        storePly(ply_path, xyz, SH2RGB(shs) * 255)
+        rng = np.random.default_rng(0)
+        xyz = rng.random((num_pts, 3), dtype=np.float32) * np.float32(2.6) - np.float32(1.3)
+        shs = rng.random((num_pts, 3), dtype=np.float32) * np.float32(1 / 255.0)
+        rgb = SH2RGB(shs)
+        normals = np.zeros_like(xyz)
+        pcd = BasicPointCloud(points=xyz, colors=rgb, normals=normals)
+
+        storePly(ply_path, xyz, (rgb * 255).astype(np.uint8), normals=normals)
     pcd = fetchPly(ply_path)
 
     scene_info = SceneInfo(point_cloud=pcd,
@@ -379,11 +426,15 @@ def readToyDeskSceneInfo(path, images, white_background, eval, extension=".jpg",
 
         # We create random points inside the bounds of 3D bbox
         # xyz = np.random.random((num_pts, 3)) * 2.6 - 1.3
-        xyz = (np.random.random((num_pts, 3)) - 0.5) * 4 * cam_centers_radius + cam_centers_center
-        shs = np.random.random((num_pts, 3)) / 255.0
-        pcd = BasicPointCloud(points=xyz, colors=SH2RGB(shs), normals=np.zeros((num_pts, 3)))
-
-        storePly(ply_path, xyz, SH2RGB(shs) * 255)
+        rng = np.random.default_rng(0)
+        xyz = (rng.random((num_pts, 3), dtype=np.float32) - np.float32(0.5)) * np.float32(4 * cam_centers_radius) \
+            + cam_centers_center.astype(np.float32)
+        shs = rng.random((num_pts, 3), dtype=np.float32) * np.float32(1 / 255.0)
+        rgb = SH2RGB(shs)
+        normals = np.zeros_like(xyz)
+        pcd = BasicPointCloud(points=xyz, colors=rgb, normals=normals)
+
+        storePly(ply_path, xyz, (rgb * 255).astype(np.uint8), normals=normals)
     pcd = fetchPly(ply_path)
 
 
@@ -394,10 +445,10 @@ def readToyDeskSceneInfo(path, images, white_background, eval, extension=".jpg",
         print("Reading split file")
         with open(split_file, "r") as f:
             split = yaml.safe_load(f)
-        train_list = split["train"]
-        test_list = split["test"]
-        train_cam_infos = [c for c in cam_infos if c.image_name in train_list]
-        test_cam_infos = [c for c in cam_infos if c.image_name in test_list]
+        train_set = set(split["train"])
+        test_set = set(split["test"])
+        train_cam_infos = [c for c in cam_infos if c.image_name in train_set]
+        test_cam_infos = [c for c in cam_infos if c.image_name in test_set]
         # else:
         #     print("Split file not found, using LLFF holdout")
         #     # NOTE: This is a hack to make sure that the same cameras are used for training and testing
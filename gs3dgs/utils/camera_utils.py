@@ -8,40 +8,22 @@
 #
 # For inquiries contact  george.drettakis@inria.fr
 #
+import os
+from concurrent.futures import ThreadPoolExecutor
+import torch
 from tqdm import tqdm
-from PIL import Image
 
 from ..arguments import ModelParams
 from ..scene.dataset_readers import CameraInfo
 from ..scene.cameras import Camera
 import numpy as np
 from .general_utils import PILtoTorch
-from .graphics_utils import fov2focal
+from .graphics_utils import fov2focal, invert_rt
 
 WARNED = False
 
-def loadCam(args, id, cam_info: CameraInfo, resolution_scale):
-    with Image.open(cam_info.image_path) as img:
-        orig_w, orig_h = img.size
-
-    if args.resolution in [1, 2, 4, 8]:
-        resolution = round(orig_w/(resolution_scale * args.resolution)), round(orig_h/(resolution_scale * args.resolution))
-    else:  # should be a type that converts to float
-        if args.resolution == -1:
-            if orig_w > 1600:
-                global WARNED
-                if not WARNED:
-                    print("[ INFO ] Encountered quite large input images (>1.6K pixels width), rescaling to 1.6K.\n "
-                        "If this is not desired, please explicitly specify '--resolution/-r' as 1")
-                    WARNED = True
-                global_down = orig_w / 1600
-            else:
-                global_down = 1
-        else:
-            global_down = orig_w / args.resolution
-
-        scale = float(global_down) * float(resolution_scale)
-        resolution = (int(orig_w / scale), int(orig_h / scale))
+def loadCam(args, id, cam_info: CameraInfo, compute_resolution):
+    resolution = compute_resolution(cam_info.width, cam_info.height)
 
     return Camera(
         colmap_id=cam_info.uid,
@@ -62,7 +44,46 @@ def cameraList_from_camInfos(cam_infos, resolution_scale, args: ModelParams):
     Camera.preload = args.preload
     print("gt image preload:", Camera.preload)
     print("This would affect the time taken to load the images")
-    camera_list = [loadCam(args, id, c, resolution_scale) for id, c in tqdm(enumerate(cam_infos))]
+
+    # args is fixed for the whole scene, so resolve the resolution policy once
+    if args.resolution in [1, 2, 4, 8]:
+        down = resolution_scale * args.resolution
+
+        def compute_resolution(orig_w, orig_h):
+            return round(orig_w / down), round(orig_h / down)
+    else:  # should be a type that converts to float
+        auto_down = args.resolution == -1
+        target_w = 1600 if auto_down else float(args.resolution)
+        resolution_scale = float(resolution_scale)
+
+        global WARNED
+        if auto_down and not WARNED and any(c.width > 1600 for c in cam_infos):
+            print("[ INFO ] Encountered quite large input images (>1.6K pixels width), rescaling to 1.6K.\n "
+                "If this is not desired, please explicitly specify '--resolution/-r' as 1")
+            WARNED = True
+
+        def compute_resolution(orig_w, orig_h):
+            if auto_down and orig_w <= 1600:
+                global_down = 1
+            else:
+                global_down = orig_w / target_w
+            scale = float(global_down) * resolution_scale
+            return int(orig_w / scale), int(orig_h / scale)
+
+    if not Camera.preload:
+        camera_list = [loadCam(args, id, c, compute_resolution) for id, c in tqdm(enumerate(cam_infos), total=len(cam_infos))]
+        return camera_list
+
+    # preloading decodes every image, so fan it out over threads; the CUDA device is per-thread state
+    with ThreadPoolExecutor(
+        max_workers=min(32, (os.cpu_count() or 1) * 4),
+        initializer=torch.cuda.set_device,
+        initargs=(torch.cuda.current_device(),),
+    ) as executor:
+        camera_list = list(tqdm(
+            executor.map(lambda item: loadCam(args, item[0], item[1], compute_resolution), enumerate(cam_infos)),
+            total=len(cam_infos),
+        ))
 
     return camera_list
 
@@ -72,7 +93,7 @@ def camera_to_JSON(id, camera : Camera):
     Rt[:3, 3] = camera.T
     Rt[3, 3] = 1.0
 
-    W2C = np.linalg.inv(Rt)
+    W2C = invert_rt(Rt)
     pos = W2C[:3, 3]
     rot = W2C[:3, :3]
     serializable_array_2d = [x.tolist() for x in rot]
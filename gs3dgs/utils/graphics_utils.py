@@ -48,6 +48,17 @@ def getWorld2View2(R, t, translate=np.array([.0, .0, .0]), scale=1.0):
     Rt = np.linalg.inv(C2W)
     return np.float32(Rt)
 
+def invert_rt(M):
+    """
+    Invert a 4x4 rigid transform [R | t] analytically as [R^T | -R^T t]
+    """
+    R = M[:3, :3]
+    t = M[:3, 3]
+    out = np.eye(4, dtype=M.dtype)
+    out[:3, :3] = R.T
+    out[:3, 3] = -R.T @ t
+    return out
+
 def getProjectionMatrix(znear, zfar, fovX, fovY):
     tanHalfFovY = math.tan((fovY / 2))
     tanHalfFovX = math.tan((fovX / 2))